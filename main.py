@@ -1,25 +1,112 @@
 # main.py
 import os
-import base64
+import asyncio
+import random
+import hashlib
+import zlib
+from contextlib import asynccontextmanager
 import httpx
+import orjson
+import pybase64 as b64
 import uvicorn
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
-from typing import Dict, Optional
+from cachetools import TTLCache
+from fastapi import FastAPI, HTTPException, Request
+from pydantic import BaseModel, ConfigDict, Field
+from typing import Annotated, Any, Dict, Optional
+from fastapi.middleware import Middleware
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import PlainTextResponse
+
+def env_flag(name: str, default: str) -> bool:
+    # "", "0" and "false" (any case) are off, anything else is on
+    return os.environ.get(name, default).strip().lower() not in ("", "0", "false")
+
+# largest decompressed body accepted from a gzip-encoded upload
+MAX_GZIP_UPLOAD_BYTES = int(os.environ.get("MAX_GZIP_UPLOAD_BYTES", str(8 * 1024 * 1024)))
+
+class GZipRequestMiddleware:
+    # GZipMiddleware only compresses responses; this inflates `Content-Encoding: gzip` uploads
+    def __init__(self, app, max_size: int):
+        self.app = app
+        self.max_size = max_size
+
+    async def __call__(self, scope, receive, send):
+        headers = dict(scope.get("headers") or ()) if scope["type"] == "http" else {}
+        if headers.get(b"content-encoding", b"").lower() != b"gzip":
+            await self.app(scope, receive, send)
+            return
+
+        chunks = []
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            chunks.append(message.get("body", b""))
+            more_body = message.get("more_body", False)
+
+        inflater = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        try:
+            body = inflater.decompress(b"".join(chunks), self.max_size + 1)
+        except zlib.error:
+            await PlainTextResponse("invalid gzip body", status_code=400)(scope, receive, send)
+            return
+        if len(body) > self.max_size:
+            await PlainTextResponse("payload too large", status_code=413)(scope, receive, send)
+            return
+
+        scope = dict(scope)
+        scope["headers"] = [
+            (k, v) for k, v in scope["headers"] if k not in (b"content-encoding", b"content-length")
+        ] + [(b"content-length", str(len(body)).encode())]
+
+        sent = False
+
+        async def inflated_receive():
+            nonlocal sent
+            if sent:
+                return await receive()
+            sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        await self.app(scope, inflated_receive, send)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # one shared client so connections to Judge0 are kept alive across requests
+    app.state.http = httpx.AsyncClient(
+        timeout=httpx.Timeout(None),
+        limits=httpx.Limits(
+            max_connections=JUDGE0_INFLIGHT_PER_WORKER,
+            max_keepalive_connections=JUDGE0_INFLIGHT_PER_WORKER,
+        ),
+        http2=True,
+        headers={"Accept-Encoding": "gzip", "User-Agent": "runner/1.0"},
+    )
+    try:
+        yield
+    finally:
+        await app.state.http.aclose()
 
 app = FastAPI(
     title="Judge0 Runner API",
     description="Execute code in multiple languages using Judge0 CE with JAR support for Java (JARs embedded as metadata)",
-    version="1.0.1"
-)
-
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],  # adjust to your frontend origin in production
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    version="1.0.1",
+    lifespan=lifespan,
+    middleware=[
+        # compress large /run responses (outermost)
+        Middleware(GZipMiddleware, minimum_size=1024),
+        # accept gzip-compressed uploads (large `files` dicts)
+        Middleware(GZipRequestMiddleware, max_size=MAX_GZIP_UPLOAD_BYTES),
+        Middleware(
+            CORSMiddleware,
+            allow_origins=["*"],  # adjust to your frontend origin in production
+            allow_credentials=True,
+            allow_methods=["*"],
+            allow_headers=["*"],
+        ),
+    ],
 )
 
 # language -> Judge0 language id
@@ -34,9 +121,62 @@ LANGUAGE_MAP = {
     "bash": 46
 }
 
+# request spelling -> canonical language key, with common casings pre-inserted so the
+# usual case needs no .lower()
+LANGUAGE_ALIASES = {k: k for k in LANGUAGE_MAP}
+LANGUAGE_ALIASES.update({k.upper(): k for k in LANGUAGE_MAP})
+LANGUAGE_ALIASES.update({k.title(): k for k in LANGUAGE_MAP})
+
+# uvicorn worker processes started by `python main.py`; each is an async event loop,
+# so a small fixed count is enough
+WEB_CONCURRENCY = int(os.environ.get("WEB_CONCURRENCY", "2"))
+
 # Judge0 CE public endpoint (no API key)
 JUDGE0_URL = "https://ce.judge0.com/submissions/?base64_encoded=true&wait=true"
 
+# cap on concurrent in-flight submissions to Judge0 across all workers; each worker
+# process gets an equal share, and its client connection pool is sized to match
+JUDGE0_MAX_INFLIGHT = int(os.environ.get("JUDGE0_MAX_INFLIGHT", "16"))
+# workers actually sharing the limit: a single process (`uvicorn main:app`) unless
+# WEB_CONCURRENCY is set, which `python main.py` does for its workers
+JUDGE0_INFLIGHT_PER_WORKER = max(1, JUDGE0_MAX_INFLIGHT // int(os.environ.get("WEB_CONCURRENCY", "1")))
+JUDGE0_SEM = asyncio.Semaphore(JUDGE0_INFLIGHT_PER_WORKER)
+
+# retries on 429 (rate limited) with exponential backoff
+JUDGE0_MAX_RETRIES = int(os.environ.get("JUDGE0_MAX_RETRIES", "3"))
+
+# limits on submission size, checked before building the Judge0 payload (counts are enforced by RunRequest).
+# MAX_SOURCE_CHARS counts characters across files, jars and stdin, not encoded bytes.
+MAX_SOURCE_CHARS = int(os.environ.get("MAX_SOURCE_CHARS", str(1024 * 1024)))
+MAX_FILES = int(os.environ.get("MAX_FILES", "512"))
+MAX_JARS = int(os.environ.get("MAX_JARS", "16"))
+
+# per-worker cache of /run results for identical submissions (blake2b digest -> response);
+# off with RESULT_CACHE_ENABLED=0 or RESULT_CACHE_SIZE=0 (e.g. for programs using random/time)
+RESULT_CACHE_SIZE = int(os.environ.get("RESULT_CACHE_SIZE", "4096"))
+RESULT_CACHE_ENABLED = env_flag("RESULT_CACHE_ENABLED", "1") and RESULT_CACHE_SIZE > 0
+RESULT_CACHE = TTLCache(
+    maxsize=RESULT_CACHE_SIZE,
+    ttl=int(os.environ.get("RESULT_CACHE_TTL", "300")),
+)
+
+# Judge0 verdicts that depend only on the submission: 3 Accepted, 4 Wrong Answer,
+# 6 Compilation Error, 7-12 runtime errors. Queue states (1, 2), Time Limit Exceeded (5),
+# Internal Error (13) and Exec Format Error (14) are never cached.
+CACHEABLE_STATUSES = frozenset({3, 4, 6, 7, 8, 9, 10, 11, 12})
+
+# base64 of empty stdin
+EMPTY_B64 = b""
+
+# include the raw Judge0 result in /run responses (debugging only, roughly doubles payload)
+DEBUG_RAW = env_flag("DEBUG_RAW", "0")
+
+# only ask Judge0 for the fields /run reads, unless the full result is echoed back
+JUDGE0_SUBMIT_URL = JUDGE0_URL if DEBUG_RAW else JUDGE0_URL + "&fields=stdout,stderr,compile_output,status"
+
+# embed JARs as comment metadata in Java sources (set EMBED_JARS=0 to skip and save bandwidth)
+EMBED_JARS = env_flag("EMBED_JARS", "1")
+
 # comment token per language (used to prefix file markers)
 COMMENT_TOKEN = {
     "python": "#",
@@ -49,82 +189,155 @@ COMMENT_TOKEN = {
     "bash": "#"
 }
 
+# precomputed bytes templates for file/JAR markers, filled with bytes % formatting
+PER_LANG_HEADER_FMT = {lang: f"{tok} FILE: %s".encode("utf-8") for lang, tok in COMMENT_TOKEN.items()}
+PER_LANG_JAR_FMT = {lang: f"{tok} JAR:%s:%s".encode("utf-8") for lang, tok in COMMENT_TOKEN.items()}
+
+async def post_to_judge0(client: httpx.AsyncClient, body: bytes, timeout) -> httpx.Response:
+    # retries share one deadline, so 429 backoff never stretches a request past `timeout`
+    loop = asyncio.get_running_loop()
+    deadline = None if timeout is None else loop.time() + timeout
+    attempt = 0
+    while True:
+        async with JUDGE0_SEM:
+            remaining = None if deadline is None else deadline - loop.time()
+            if remaining is not None and remaining <= 0:
+                raise httpx.TimeoutException("Judge0 deadline exceeded")
+            res = await client.post(
+                JUDGE0_SUBMIT_URL,
+                content=body,
+                headers={"Content-Type": "application/json"},
+                timeout=remaining,
+            )
+        if res.status_code != 429 or attempt >= JUDGE0_MAX_RETRIES:
+            return res
+        delay = 2 ** attempt + random.random()
+        if deadline is not None and loop.time() + delay >= deadline:
+            return res
+        # back off outside the semaphore so other requests can proceed
+        await asyncio.sleep(delay)
+        attempt += 1
+
 class RunRequest(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
     language: str
     entrypoint: str
-    files: Dict[str, str]
-    jars: Optional[Dict[str, str]] = None  # base64 strings of jar content (optional)
+    files: Annotated[Dict[str, str], Field(max_length=MAX_FILES)]
+    jars: Optional[Annotated[Dict[str, str], Field(max_length=MAX_JARS)]] = None  # base64 strings of jar content (optional)
     stdin: Optional[str] = None
     timeout_seconds: Optional[int] = 10
 
-@app.post("/run")
-async def run_code(req: RunRequest):
-    lang = req.language.lower()
-    if lang not in LANGUAGE_MAP:
+class RunResponse(BaseModel):
+    output: str
+    error: Optional[str]
+    success: bool
+    raw: Optional[Dict[str, Any]] = None  # only set when DEBUG_RAW is on
+
+@app.post("/run", response_model=RunResponse, response_model_exclude_unset=True)
+async def run_code(req: RunRequest, request: Request):
+    lang = LANGUAGE_ALIASES.get(req.language) or LANGUAGE_ALIASES.get(req.language.lower())
+    if lang is None:
         raise HTTPException(status_code=400, detail=f"Unsupported language: {req.language}")
 
     if not req.files or not isinstance(req.files, dict):
         raise HTTPException(status_code=400, detail="`files` must be a dict of filename -> content")
 
-    # determine comment prefix for this language
-    comment = COMMENT_TOKEN.get(lang, "//")
+    # reject oversized submissions before any encoding or network work
+    # (file/jar counts are already capped by RunRequest validation)
+    # jars only count when they are embedded into the source sent to Judge0
+    embed_jars = bool(req.jars) and EMBED_JARS and lang == "java"
+    approx = sum(len(v) for v in req.files.values()) + len(req.stdin or "")
+    if embed_jars:
+        approx += sum(len(v) for v in req.jars.values())
+    if approx > MAX_SOURCE_CHARS:
+        raise HTTPException(status_code=413, detail="payload too large")
 
-    # Build combined source with language-appropriate file markers
+    # marker templates for this language
+    hdr_fmt = PER_LANG_HEADER_FMT[lang]
+
+    # Build combined source as utf-8 bytes with language-appropriate file markers
     combined_parts = []
     for filename, content in req.files.items():
         # Use comment marker so combined header is a comment in the target language
-        combined_parts.append(f"{comment} FILE: {filename}")
-        combined_parts.append(content)
+        combined_parts.append(hdr_fmt % filename.encode("utf-8"))
+        combined_parts.append(content.encode("utf-8"))
 
-    # Append JAR metadata (non-executable comment lines) if provided
-    if req.jars:
+    # Append JAR metadata (non-executable comment lines) for Java only
+    if embed_jars:
+        jar_fmt = PER_LANG_JAR_FMT[lang]
         for jar_name, jar_b64 in req.jars.items():
-            # Do not decode here; just include metadata so you can parse later if needed
-            combined_parts.append(f"{comment} JAR:{jar_name}:{jar_b64}")
+            # Already base64 text: append as-is, no decode/re-encode round trip
+            combined_parts.append(jar_fmt % (jar_name.encode("utf-8"), jar_b64.encode("utf-8")))
 
-    combined_source = "\n\n".join(combined_parts)
+    combined_source = b"\n\n".join(combined_parts)
+    stdin_bytes = req.stdin.encode("utf-8") if req.stdin else b""
 
-    # Base64 encode source and stdin because we're calling Judge0 with base64_encoded=true
-    payload = {
-        "language_id": LANGUAGE_MAP[lang],
-        "source_code": base64.b64encode(combined_source.encode("utf-8")).decode("utf-8"),
-        "stdin": base64.b64encode((req.stdin or "").encode("utf-8")).decode("utf-8")
-    }
+    # identical (language, source, stdin) submissions are served from the cache;
+    # the source length keeps the source/stdin boundary unambiguous
+    lid = LANGUAGE_MAP[lang]
+    cache_key = None
+    if RESULT_CACHE_ENABLED:
+        h = hashlib.blake2b(lid.to_bytes(2, "big") + len(combined_source).to_bytes(8, "big"), digest_size=16)
+        h.update(combined_source)
+        h.update(stdin_bytes)
+        cache_key = h.digest()
+        cached = RESULT_CACHE.get(cache_key)
+        if cached is not None:
+            return cached
+
+    # Base64 encode source and stdin because we're calling Judge0 with base64_encoded=true.
+    # Base64 output needs no JSON escaping, so the body is assembled from bytes directly
+    # instead of decoding to str and re-serializing.
+    source_b64 = b64.b64encode(combined_source)
+    stdin_b64 = EMPTY_B64 if not stdin_bytes else b64.b64encode(stdin_bytes)
+    body = b"".join((
+        b'{"language_id":%d,"source_code":"' % lid,
+        source_b64,
+        b'","stdin":"',
+        stdin_b64,
+        b'"}',
+    ))
+
+    # Post to Judge0 CE (per-request timeout, pooled connection)
+    client = request.app.state.http
+    try:
+        res = await post_to_judge0(client, body, req.timeout_seconds)
+    except httpx.TimeoutException:
+        raise HTTPException(status_code=504, detail="Judge0 timed out")
+
+    if res.status_code not in (200, 201):
+        # forward helpful debug
+        raise HTTPException(status_code=res.status_code, detail=res.text)
 
-    # Post to Judge0 CE
-    async with httpx.AsyncClient(timeout=req.timeout_seconds) as client:
+    result = orjson.loads(res.content)
+
+    # Judge0 returns base64-encoded stdout/stderr/compile_output when base64_encoded=true
+    def decode_b64_field(field_name):
+        v = result.get(field_name)
+        if not v:
+            return ""
         try:
-            res = await client.post(JUDGE0_URL, json=payload)
-        except httpx.TimeoutException:
-            raise HTTPException(status_code=504, detail="Judge0 timed out")
-
-        if res.status_code not in (200, 201):
-            # forward helpful debug
-            raise HTTPException(status_code=res.status_code, detail=res.text)
-
-        result = res.json()
-
-        # Judge0 returns base64-encoded stdout/stderr/compile_output when base64_encoded=true
-        def decode_b64_field(field_name):
-            v = result.get(field_name)
-            if not v:
-                return ""
-            try:
-                return base64.b64decode(v).decode("utf-8", errors="replace")
-            except Exception:
-                return f"<failed to decode {field_name}>"
-
-        stdout = decode_b64_field("stdout")
-        stderr = decode_b64_field("stderr") or decode_b64_field("compile_output")
-
-        success = (not stderr) and (result.get("status", {}).get("id") in (3, 4))  # 3=Accepted? judge0 statuses vary
-
-        return {
-            "output": stdout,
-            "error": stderr if stderr else None,
-            "success": success,
-            "raw": result  # optional: remove in production if too verbose
-        }
+            return b64.b64decode(v, validate=False).decode("utf-8", errors="replace")
+        except Exception:
+            return f"<failed to decode {field_name}>"
+
+    stdout = decode_b64_field("stdout")
+    stderr = decode_b64_field("stderr") or decode_b64_field("compile_output")
+
+    status_id = (result.get("status") or {}).get("id")
+    success = (not stderr) and (status_id in (3, 4))  # 3=Accepted? judge0 statuses vary
+
+    out = {
+        "output": stdout,
+        "error": stderr if stderr else None,
+        "success": success,
+    }
+    if DEBUG_RAW:
+        out["raw"] = result  # full Judge0 response, base64 fields included
+    if cache_key is not None and status_id in CACHEABLE_STATUSES:
+        RESULT_CACHE[cache_key] = out
+    return out
 
 @app.get("/")
 def root():
@@ -132,4 +345,14 @@ def root():
 
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 8000))
-    uvicorn.run("main:app", host="0.0.0.0", port=port)
+    # worker processes re-import main; make them split JUDGE0_MAX_INFLIGHT by the real count
+    os.environ["WEB_CONCURRENCY"] = str(WEB_CONCURRENCY)
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=port,
+        workers=WEB_CONCURRENCY,
+        loop="auto",  # uvloop / httptools when installed (uvicorn[standard])
+        http="auto",
+        log_level=os.environ.get("LOG_LEVEL", "info"),
+    )
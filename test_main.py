@@ -0,0 +1,179 @@
+import asyncio
+import gzip
+import importlib
+from types import SimpleNamespace
+
+import httpx
+import orjson
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+
+
+@pytest.fixture
+def judge0(monkeypatch):
+    """Replace the Judge0 call. `calls` records request bodies; `replies` queues status ids."""
+    fake = SimpleNamespace(calls=[], replies=[], fake_post=None)
+
+    async def fake_post(client, body, timeout):
+        fake.calls.append(body)
+        status_id = fake.replies.pop(0) if fake.replies else 3
+        return httpx.Response(200, json={"stdout": "b2s=", "status": {"id": status_id}})
+
+    fake.fake_post = fake_post
+    main.RESULT_CACHE.clear()
+    monkeypatch.setattr(main, "post_to_judge0", fake_post)
+    yield fake
+    main.RESULT_CACHE.clear()
+
+
+@pytest.fixture
+def client():
+    with TestClient(main.app) as c:
+        yield c
+
+
+def submit(client, source="print('ok')", stdin=None, language="python", jars=None):
+    payload = {"language": language, "entrypoint": "m.py", "files": {"m.py": source}}
+    if stdin is not None:
+        payload["stdin"] = stdin
+    if jars is not None:
+        payload["jars"] = jars
+    return client.post("/run", json=payload)
+
+
+def run(client, source="print('ok')", stdin=None):
+    res = submit(client, source, stdin)
+    assert res.status_code == 200
+    return res.json()
+
+
+def test_identical_submission_is_served_from_cache(client, judge0):
+    first = run(client)
+    second = run(client)
+    assert first == second == {"output": "ok", "error": None, "success": True}
+    assert len(judge0.calls) == 1
+
+
+@pytest.mark.parametrize("status_id", [1, 2, 5, 13, 14])
+def test_non_final_or_infrastructure_status_is_not_cached(client, judge0, status_id):
+    judge0.replies.extend([status_id, 3])
+    assert run(client)["success"] is False
+    assert run(client)["success"] is True
+    assert len(judge0.calls) == 2
+
+
+def test_cache_key_keeps_source_and_stdin_apart(client, judge0):
+    run(client, source="print(1)b")
+    run(client, source="print(1)", stdin="b")
+    assert len(judge0.calls) == 2
+
+
+@pytest.mark.parametrize("setting", ["RESULT_CACHE_ENABLED=0", "RESULT_CACHE_SIZE=0"])
+def test_disabled_cache_always_reaches_judge0(judge0, monkeypatch, setting):
+    name, value = setting.split("=")
+    monkeypatch.setenv(name, value)
+    importlib.reload(main)
+    monkeypatch.setattr(main, "post_to_judge0", judge0.fake_post)
+    try:
+        with TestClient(main.app) as c:
+            run(c)
+            run(c)
+        assert len(judge0.calls) == 2
+    finally:
+        monkeypatch.delenv(name)
+        importlib.reload(main)
+
+
+def test_oversized_submission_is_rejected_before_judge0(client, judge0, monkeypatch):
+    monkeypatch.setattr(main, "MAX_SOURCE_CHARS", 100)
+    assert submit(client, source="x" * 101).status_code == 413
+    assert submit(client, source="x", stdin="y" * 100).status_code == 413
+    assert submit(client, language="java", jars={"lib.jar": "A" * 100}).status_code == 413
+    assert judge0.calls == []
+
+
+def test_dropped_jars_do_not_count_toward_size_limit(client, judge0, monkeypatch):
+    monkeypatch.setattr(main, "MAX_SOURCE_CHARS", 100)
+    assert submit(client, jars={"lib.jar": "A" * 1000}).status_code == 200
+    monkeypatch.setattr(main, "EMBED_JARS", False)
+    assert submit(client, language="java", jars={"lib.jar": "A" * 1000}).status_code == 200
+
+
+@pytest.fixture
+def rate_limited(monkeypatch):
+    """Post through post_to_judge0 against a fake Judge0 answering with `statuses` in order.
+
+    Backoff sleeps are recorded instead of slept. Returns (response, request count, delays).
+    """
+    delays = []
+
+    async def fake_sleep(delay):
+        delays.append(delay)
+
+    monkeypatch.setattr(main.asyncio, "sleep", fake_sleep)
+
+    def post(statuses, timeout=60):
+        statuses = list(statuses)
+        seen = []
+
+        def handler(request):
+            seen.append(request)
+            return httpx.Response(statuses.pop(0), json={})
+
+        async def go():
+            async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as c:
+                return await main.post_to_judge0(c, b"{}", timeout)
+
+        return asyncio.run(go()), len(seen), delays
+
+    return post
+
+
+def test_post_to_judge0_retries_rate_limited_requests(rate_limited):
+    res, requests, delays = rate_limited([429, 429, 200])
+    assert res.status_code == 200
+    assert requests == 3
+    assert len(delays) == 2
+
+
+def test_post_to_judge0_gives_up_after_max_retries(rate_limited):
+    res, requests, _ = rate_limited([429] * (main.JUDGE0_MAX_RETRIES + 1))
+    assert res.status_code == 429
+    assert requests == main.JUDGE0_MAX_RETRIES + 1
+
+
+def test_post_to_judge0_backoff_stays_within_timeout(rate_limited):
+    # the first backoff is at least 1s, which would overrun a 1s deadline
+    res, requests, delays = rate_limited([429, 200], timeout=1)
+    assert res.status_code == 429
+    assert requests == 1
+    assert delays == []
+
+
+def test_gzip_encoded_upload_is_accepted(client, judge0):
+    body = orjson.dumps({"language": "python", "entrypoint": "m.py", "files": {"m.py": "print('ok')"}})
+    res = client.post(
+        "/run",
+        content=gzip.compress(body),
+        headers={"Content-Type": "application/json", "Content-Encoding": "gzip"},
+    )
+    assert res.status_code == 200
+    assert res.json()["output"] == "ok"
+    assert len(judge0.calls) == 1
+
+
+@pytest.mark.parametrize(
+    "content, status",
+    [(gzip.compress(b"{" + b" " * 100 + b"}"), 413), (b"not gzip", 400)],
+)
+def test_bad_gzip_upload_is_rejected(judge0, content, status):
+    with TestClient(main.GZipRequestMiddleware(main.app, max_size=64)) as c:
+        res = c.post(
+            "/run",
+            content=content,
+            headers={"Content-Type": "application/json", "Content-Encoding": "gzip"},
+        )
+    assert res.status_code == status
+    assert judge0.calls == []